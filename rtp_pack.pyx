@@ -0,0 +1,74 @@
+# cython: boundscheck=False, wraparound=False
+"""
+Optional compiled RTP/JPEG packetizer for rtsp_server.py.
+Build it in place with:  cythonize -i rtp_pack.pyx
+If it is not built, rtsp_server.py packetizes frames in pure Python instead.
+"""
+from libc.string cimport memcpy
+
+cpdef tuple packetize(
+    const unsigned char[::1] scan,
+    Py_ssize_t offset,
+    const unsigned char[::1] quant_header,
+    const unsigned char[::1] jpeg_header,
+    unsigned char[:, ::1] out_packets,
+    unsigned int[::1] out_lengths,
+    unsigned short sequence_number,
+    unsigned int timestamp,
+    unsigned int ssrc,
+    unsigned char payload_type,
+):
+    """
+    Writes complete RTP/JPEG (RFC 2435) packets for scan[offset:] into the rows of
+    out_packets, one packet per row, and their sizes into out_lengths.
+    jpeg_header holds the JPEG header bytes that follow the fragment offset (type, Q,
+    width/8, height/8 and, with restart markers, the restart header). The first
+    packet of a frame (offset 0) also carries quant_header.
+    Returns (packet_count, next_offset, next_sequence_number).
+    """
+    cdef Py_ssize_t scan_size = scan.shape[0]
+    cdef Py_ssize_t max_packets = out_packets.shape[0]
+    cdef Py_ssize_t header_size = 16 + jpeg_header.shape[0] # RTP header + offset field + rest of JPEG header
+    cdef Py_ssize_t count = 0
+    cdef Py_ssize_t payload_start, payload_size
+    cdef unsigned char *packet
+
+    while offset < scan_size and count < max_packets:
+        packet = &out_packets[count, 0]
+        payload_start = header_size
+        if offset == 0:
+            memcpy(packet + payload_start, &quant_header[0], quant_header.shape[0])
+            payload_start += quant_header.shape[0]
+        payload_size = out_packets.shape[1] - payload_start
+        if payload_size > scan_size - offset:
+            payload_size = scan_size - offset
+
+        # RTP header; the marker bit is set on the last packet of the frame.
+        packet[0] = 0x80
+        packet[1] = payload_type | (0x80 if offset + payload_size == scan_size else 0)
+        packet[2] = sequence_number >> 8
+        packet[3] = sequence_number & 0xFF
+        packet[4] = timestamp >> 24
+        packet[5] = (timestamp >> 16) & 0xFF
+        packet[6] = (timestamp >> 8) & 0xFF
+        packet[7] = timestamp & 0xFF
+        packet[8] = ssrc >> 24
+        packet[9] = (ssrc >> 16) & 0xFF
+        packet[10] = (ssrc >> 8) & 0xFF
+        packet[11] = ssrc & 0xFF
+
+        # JPEG header: type-specific byte (0) and 24-bit fragment offset, then the rest.
+        packet[12] = 0
+        packet[13] = (offset >> 16) & 0xFF
+        packet[14] = (offset >> 8) & 0xFF
+        packet[15] = offset & 0xFF
+        memcpy(packet + 16, &jpeg_header[0], jpeg_header.shape[0])
+
+        memcpy(packet + payload_start, &scan[offset], payload_size)
+        out_lengths[count] = payload_start + payload_size
+
+        offset += payload_size
+        sequence_number += 1 # Wraps at 16 bits
+        count += 1
+
+    return count, offset, sequence_number
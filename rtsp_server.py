@@ -1,9 +1,40 @@
 import socket
 import struct
+import ctypes
 import cv2
+import numpy as np
 import time
 import threading
 import sys
+import os
+import re
+import queue
+import selectors
+import bisect
+from collections import deque, namedtuple
+
+# simplejpeg wraps libjpeg-turbo directly and is noticeably faster than
+# cv2.imencode. It is optional; we fall back to OpenCV if it isn't installed.
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# rtp_pack is the optional Cython packetizer (rtp_pack.pyx). When it has been
+# built, each batch of packets is assembled in C instead of packet by packet
+# in Python.
+try:
+    import rtp_pack
+except ImportError:
+    rtp_pack = None
+
+# GStreamer bindings are only needed for hardware JPEG encoding (USE_HW_ENCODE).
+try:
+    import gi
+    gi.require_version('Gst', '1.0')
+    from gi.repository import Gst
+except (ImportError, ValueError):
+    Gst = None
 
 # --- Configuration ---
 # UDP port for RTP video streaming. This is where the actual video data goes.
@@ -28,243 +59,1199 @@ MAX_PACKET_SIZE = 1400
 # JPEG compression quality (0-100). Higher quality means larger frames/packets.
 JPEG_QUALITY = 80
 
+# Restart interval written into each JPEG, in MCUs (16x16 pixel blocks), or 0 for
+# none. With restart markers every RTP packet starts on a restart interval, so a
+# receiver can resynchronize within a frame after a lost packet. This costs a few
+# percent of bandwidth (the markers, and packets cut short at interval boundaries).
+# simplejpeg cannot write restart markers, so OpenCV encodes frames when it is set.
+JPEG_RESTART_INTERVAL = 0
+
+# Maximum number of frames per second sent to the client. Frames captured faster
+# than this are grabbed but never decoded or encoded.
+TARGET_FPS = 30
+# How early (as a fraction of the frame interval) a frame may arrive and still be
+# sent, so that a source running at TARGET_FPS keeps every frame despite jitter.
+FRAME_SCHEDULE_TOLERANCE = 0.25
+
+# Set the RTP_CPU environment variable to a core number to pin the RTP sending
+# thread to it (Linux only); unset leaves scheduling to the OS. For the lowest
+# latency, also pin the outgoing NIC's TX queue interrupt to the same core via
+# /proc/irq/<N>/smp_affinity.
+
+# IP TOS byte for RTP packets: DSCP EF (46), so network queues along the path
+# give the stream low-latency treatment.
+RTP_IP_TOS = 0xB8
+# Linux socket priority for RTP packets (0-6 without CAP_NET_ADMIN).
+RTP_SOCKET_PRIORITY = 6
+
+# Capture, JPEG encoding and sending run in separate threads connected by these
+# bounded queues. When a queue is full the oldest frame is dropped, so a slow
+# encoder or network never stalls the camera.
+RAW_FRAME_QUEUE_SIZE = 2
+JPEG_FRAME_QUEUE_SIZE = 4
+# Raw frame buffers are recycled through a free-list instead of allocating a new
+# array per frame: enough for a full raw queue, one frame being captured and one
+# being encoded.
+FRAME_POOL_SIZE = RAW_FRAME_QUEUE_SIZE + 2
+# How often (in seconds) threads blocked on a queue re-check streaming_active.
+FRAME_QUEUE_POLL_TIMEOUT = 0.5
+# Queued by each stage when it stops, so the next stage stops right away instead
+# of waiting out its poll timeout and a new stream can start sooner.
+END_OF_STREAM = None
+
+# Capture and JPEG-encode on the GPU with a GStreamer pipeline instead of
+# OpenCV + CPU encoding. Requires the GStreamer Python bindings (gi) and the
+# NVIDIA nvvidconv/nvjpegenc elements (e.g. Jetson). If the pipeline cannot be
+# started the server falls back to the OpenCV path.
+USE_HW_ENCODE = False
+HW_ENCODE_PIPELINE = (
+    "v4l2src device=/dev/video0 ! video/x-raw,width=1280,height=720 ! "
+    f"nvvidconv ! nvjpegenc quality={JPEG_QUALITY} ! "
+    "appsink name=sink emit-signals=true max-buffers=2 drop=true"
+)
+
 # --- Global Flags and Resources for Control ---
-# Flag to control the RTP streaming thread. Set to False to stop streaming.
-streaming_active = False
+# Set while the RTP streaming thread should run. Clear it to stop streaming.
+streaming_active = threading.Event()
+# Set when streaming is stopped from outside the RTP thread, so the thread wakes
+# up from its frame pacing wait immediately instead of finishing the sleep.
+streaming_stopped = threading.Event()
 # Reference to the RTP streaming thread.
 rtp_thread = None
+# Set between a PLAY and the moment its stream actually starts, which waits for
+# the previous stream to shut down first.
+rtp_start_pending = False
+# Guards starting and stopping streams, which happen on different threads.
+streaming_lock = threading.Lock()
 # Sockets for RTSP server and client connections.
 rtsp_server_socket = None
-rtsp_client_socket = None
-rtsp_client_address = None
+# Connected RTSP clients, keyed by socket file descriptor: fd -> RtspClient.
+rtsp_clients = {}
+# Selector multiplexing the listening socket and all client sockets in one thread.
+rtsp_selector = None
+RTSP_SELECT_TIMEOUT = 0.5 # Seconds between checks for server shutdown
+# Largest RTSP request accepted; a client sending more without ending its headers is dropped.
+RTSP_MAX_REQUEST_SIZE = 8192
 rtsp_server_thread = None # Reference to the RTSP listening thread
 
 # --- RTP Packet Structure (Simplified) ---
 RTP_HEADER_SIZE = 12
+RTP_VERSION_BYTE = 0x80 # Version 2, no padding, no extension, no CSRCs
+RTP_PAYLOAD_TYPE_JPEG = 26
+RTP_MARKER_BIT = 0x80 # Set on the last packet of each frame
+
+# --- RTP/JPEG Payload Format (RFC 2435) ---
+# Every packet carries an 8-byte JPEG header after the RTP header, followed by a
+# 4-byte restart marker header if the JPEG uses restart intervals. The first
+# packet of a frame also carries the quantization tables (Q = 255), so only the
+# entropy-coded scan data is sent and the receiver rebuilds the JPEG headers.
+JPEG_HEADER_SIZE = 8
+JPEG_RESTART_HEADER_SIZE = 4
+JPEG_Q_DYNAMIC_TABLES = 255
+# Width and height are sent in units of 8 pixels in one byte each, so frames are
+# limited to 2040x2040. Larger frames are downscaled before encoding.
+JPEG_MAX_DIMENSION = 2040
+# RTP header followed by the JPEG header's type-specific byte (0) and 24-bit
+# fragment offset, packed per packet. Precompiled so the format string is not
+# parsed on every call.
+RTP_JPEG_HEADER = struct.Struct("!BBHIII")
+# Restart marker header fields after the restart interval: F and L flag the first
+# and last packet of a restart interval, followed by a 14-bit restart count.
+JPEG_RESTART_FIRST = 0x8000
+JPEG_RESTART_LAST = 0x4000
+JPEG_RESTART_COUNT_MASK = 0x3FFF
+JPEG_RESTART_FIELD = struct.Struct("!H")
+# RSTn markers; in entropy-coded data 0xFF is otherwise always followed by 0x00.
+RESTART_MARKER_RE = re.compile(rb"\xff[\xd0-\xd7]")
+# Space reserved per packet in the header buffer: RTP + JPEG + restart headers.
+RTP_JPEG_HEADER_SLOT_SIZE = RTP_HEADER_SIZE + JPEG_HEADER_SIZE + JPEG_RESTART_HEADER_SIZE
+
+# Header information extracted from an encoded JPEG frame.
+JpegInfo = namedtuple("JpegInfo", [
+    "rfc_type",           # RFC 2435 type: 0 (4:2:2) or 1 (4:2:0), +64 with restart markers
+    "width",
+    "height",
+    "restart_interval",   # MCUs between restart markers, 0 if none
+    "quant_header",       # Quantization table header + tables for the first packet
+    "scan_start",         # Offset of the entropy-coded data after the SOS segment
+])
+
+# Kernel send buffer for the RTP socket. A full HD frame is dozens of packets
+# sent back to back, so the default buffer is enlarged to absorb the burst.
+RTP_SEND_BUFFER_SIZE = 4 * 1024 * 1024
+
+# Maximum number of RTP packets handed to the kernel in one sendmmsg() call.
+# Larger batches give diminishing returns.
+SEND_BATCH_SIZE = 64
+
+# --- Zero-copy sends (Linux MSG_ZEROCOPY) ---
+# With MSG_ZEROCOPY the kernel sends straight from our buffers instead of copying
+# them, and reports on the socket's error queue once it no longer needs them.
+# Tracking those completions costs more than copying small packets, so it is only
+# used when packets carry at least ZEROCOPY_MIN_PAYLOAD bytes (i.e. with
+# MAX_PACKET_SIZE raised for jumbo frames or loopback).
+ZEROCOPY_MIN_PAYLOAD = 8192
+SO_ZEROCOPY = 60 # Not exposed by the socket module
+MSG_ZEROCOPY = 0x4000000
+SO_EE_ORIGIN_ZEROCOPY = 5
+# struct sock_extended_err, as read from the socket error queue.
+SOCK_EXTENDED_ERR = struct.Struct("=IBBBBII")
 
-def create_rtp_header(sequence_number, timestamp, ssrc):
+# --- Batched UDP sending (Linux sendmmsg) ---
+# sendmmsg() sends a whole frame's worth of packets in a single syscall instead
+# of one sendto() per packet. It is only available on Linux; other platforms
+# fall back to sending the packets one by one.
+class _IOVec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_void_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_IOVec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _MsgHdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+try:
+    _libc = ctypes.CDLL('libc.so.6', use_errno=True)
+    _sendmmsg = _libc.sendmmsg
+    _sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    _sendmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    _sendmmsg = None
+
+def sendmmsg_all(fd, msgs, count, flags=0):
     """
-    Constructs a simplified RTP header as bytes.
+    Calls sendmmsg() until the first count messages of msgs have all been sent.
     """
-    version_padding_extension_csrc = 0x80
-    payload_type = 26
-    marker_payload_type = payload_type
-    header = struct.pack(
-        "!BBHII",
-        version_padding_extension_csrc,
-        marker_payload_type,
-        sequence_number,
-        timestamp,
-        ssrc
-    )
-    return header
+    sent = 0
+    while sent < count:
+        result = _sendmmsg(fd, ctypes.addressof(msgs) + sent * ctypes.sizeof(_MMsgHdr), count - sent, flags)
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        sent += result
+
+def pack_sockaddr_in(address):
+    """
+    Packs an (IPv4 address, port) tuple into a struct sockaddr_in for msg_name.
+    """
+    host, port = address
+    raw = struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(host) + bytes(8)
+    return ctypes.create_string_buffer(raw, len(raw))
+
+def set_destination(msgs, destination):
+    """
+    Points msg_name of every message header at the packed destination address.
+    The RTP socket is not connected: on a connected UDP socket every ICMP port
+    unreachable fails the next send, and nothing listening on RTP_PORT is normal.
+    """
+    sockaddr = pack_sockaddr_in(destination)
+    msgs._sockaddr = sockaddr # Keep the address alive as long as the headers
+    for msg in msgs:
+        msg.msg_hdr.msg_name = ctypes.addressof(sockaddr)
+        msg.msg_hdr.msg_namelen = len(sockaddr)
+
+def buffer_address(buffer):
+    """
+    Returns the memory address of a contiguous bytes-like object (read-only or not).
+    """
+    return np.frombuffer(buffer, dtype=np.uint8).ctypes.data
+
+# Every gather send uses this many iovecs per packet: RTP/JPEG headers, the
+# quantization tables and the payload. The quantization tables part is
+# zero-length except in the first packet of a frame.
+GATHER_PARTS = 3
+
+# Reusable sendmmsg() message headers for gather sends, allocated once per stream.
+GatherBatch = namedtuple("GatherBatch", [
+    "msgs",        # sendmmsg() message headers, GATHER_PARTS iovecs each
+    "iov_fields",  # the iovecs as a flat array of (base, length) integers
+])
+
+def create_gather_batch(destination):
+    """
+    Allocates a GatherBatch for SEND_BATCH_SIZE packets to destination, or returns
+    None without sendmmsg(). The message headers point at the destination and their
+    iovecs once up front; per batch only the iovec bases and lengths are written.
+    """
+    if _sendmmsg is None:
+        return None
+    iovecs = (_IOVec * (SEND_BATCH_SIZE * GATHER_PARTS))()
+    msgs = (_MMsgHdr * SEND_BATCH_SIZE)()
+    msgs._iovecs = iovecs # Keep the iovecs alive as long as the headers
+    for i in range(SEND_BATCH_SIZE):
+        msgs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i * GATHER_PARTS])
+        msgs[i].msg_hdr.msg_iovlen = GATHER_PARTS
+    set_destination(msgs, destination)
+    # struct iovec is (pointer, size_t), so the whole batch can be written with one
+    # slice assignment of integers.
+    iov_fields = (ctypes.c_size_t * (2 * len(iovecs))).from_buffer(iovecs)
+    return GatherBatch(msgs, iov_fields)
+
+def send_rtp_packets(rtp_socket, packets, destination):
+    """
+    Sends a list of RTP packets to destination one by one, for platforms without
+    sendmmsg(). Each packet is a sequence of buffers (e.g. header and payload
+    memoryviews) that the kernel gathers into one datagram where sendmsg() is available.
+    """
+    if hasattr(rtp_socket, "sendmsg"):
+        for parts in packets:
+            rtp_socket.sendmsg(parts, [], 0, destination)
+    else: # Windows has no sendmsg()
+        for parts in packets:
+            rtp_socket.sendto(b"".join(parts), destination)
+
+def send_gather_batch(rtp_socket, gather_batch, iov_fields, flags=0):
+    """
+    Sends up to SEND_BATCH_SIZE RTP packets to the GatherBatch's destination in
+    one sendmmsg() call. iov_fields holds GATHER_PARTS (address, length) pairs per
+    packet, flattened; the kernel gathers each packet's parts into one datagram,
+    so the payload is never copied in Python. The caller keeps the buffers alive
+    until this function returns (or, with MSG_ZEROCOPY in flags, until the kernel
+    reports completion).
+    """
+    gather_batch.iov_fields[: len(iov_fields)] = iov_fields
+    sendmmsg_all(rtp_socket.fileno(), gather_batch.msgs, len(iov_fields) // (2 * GATHER_PARTS), flags)
+
+def enable_zerocopy(rtp_socket):
+    """
+    Turns on SO_ZEROCOPY for the socket. Returns False if it is not supported.
+    """
+    if _sendmmsg is None: # Linux only
+        return False
+    try:
+        rtp_socket.setsockopt(socket.SOL_SOCKET, SO_ZEROCOPY, 1)
+    except OSError:
+        return False
+    return True
+
+def read_zerocopy_completions(rtp_socket):
+    """
+    Drains zero-copy completion notifications from the socket's error queue.
+    Returns the highest completed send id, or None if there were none.
+    """
+    completed = None
+    while True:
+        try:
+            _, ancdata, _, _ = rtp_socket.recvmsg(0, 1024, socket.MSG_ERRQUEUE | socket.MSG_DONTWAIT)
+        except (BlockingIOError, InterruptedError):
+            return completed
+        for _, _, data in ancdata:
+            # struct sock_extended_err; ee_info..ee_data is the completed id range.
+            _, origin, _, _, _, _, last_id = SOCK_EXTENDED_ERR.unpack_from(data)
+            if origin == SO_EE_ORIGIN_ZEROCOPY and (completed is None or last_id > completed):
+                completed = last_id
+
+# A reusable batch of contiguous packet buffers filled by rtp_pack.packetize().
+PacketBatch = namedtuple("PacketBatch", [
+    "packets",      # uint8 array, one packet per row of MAX_PACKET_SIZE bytes
+    "lengths",      # uint32 array with the size of each packet
+    "msgs",         # sendmmsg() message headers, one per row (None without sendmmsg)
+    "iov_lengths",  # numpy view of the iovec length fields
+])
+
+def create_packet_batch(destination):
+    """
+    Allocates a PacketBatch of SEND_BATCH_SIZE packets to destination. The
+    sendmmsg() headers point at the destination and the rows once up front; per
+    batch only the lengths are updated.
+    """
+    packets = np.empty((SEND_BATCH_SIZE, MAX_PACKET_SIZE), dtype=np.uint8)
+    lengths = np.empty(SEND_BATCH_SIZE, dtype=np.uint32)
+    if _sendmmsg is None:
+        return PacketBatch(packets, lengths, None, None)
+
+    iovecs = (_IOVec * SEND_BATCH_SIZE)()
+    msgs = (_MMsgHdr * SEND_BATCH_SIZE)()
+    msgs._iovecs = iovecs # Keep the iovecs alive as long as the headers
+    for i in range(SEND_BATCH_SIZE):
+        iovecs[i].iov_base = packets.ctypes.data + i * MAX_PACKET_SIZE
+        msgs[i].msg_hdr.msg_iov = ctypes.pointer(iovecs[i])
+        msgs[i].msg_hdr.msg_iovlen = 1
+    set_destination(msgs, destination)
+    # struct iovec is (pointer, size_t): viewing it as pairs of uintp lets a whole
+    # batch of lengths be written with one numpy assignment.
+    iov_lengths = np.frombuffer(iovecs, dtype=np.uintp).reshape(SEND_BATCH_SIZE, 2)[:, 1]
+    return PacketBatch(packets, lengths, msgs, iov_lengths)
+
+def send_packet_batch(rtp_socket, batch, count, destination):
+    """
+    Sends the first count packets of a PacketBatch to destination.
+    """
+    if batch.msgs is None:
+        for i in range(count):
+            rtp_socket.sendto(batch.packets[i, : batch.lengths[i]], destination)
+        return
+    batch.iov_lengths[:count] = batch.lengths[:count]
+    sendmmsg_all(rtp_socket.fileno(), batch.msgs, count)
+
+def encode_jpeg(frame):
+    """
+    Encodes a BGR frame to JPEG bytes, using simplejpeg when available and no
+    JPEG_RESTART_INTERVAL is set.
+    The output is 4:2:0 subsampled, as required by RTP/JPEG (RFC 2435).
+    """
+    if simplejpeg is not None and not JPEG_RESTART_INTERVAL:
+        return simplejpeg.encode_jpeg(frame, quality=JPEG_QUALITY, colorspace='BGR', colorsubsampling='420', fastdct=True)
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
+    if JPEG_RESTART_INTERVAL:
+        encode_param += [int(cv2.IMWRITE_JPEG_RST_INTERVAL), JPEG_RESTART_INTERVAL]
+    _, encoded_frame = cv2.imencode('.jpg', frame, encode_param)
+    return encoded_frame.tobytes()
+
+def parse_jpeg(jpeg_data):
+    """
+    Parses the headers of a baseline JPEG (everything up to the start of scan)
+    into a JpegInfo for RTP/JPEG packetization.
+    Raises ValueError if the image cannot be carried by RFC 2435.
+    """
+    if jpeg_data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG image (missing SOI marker)")
+
+    quant_tables = {}
+    frame_header = None
+    restart_interval = 0
+    pos = 2
+    while True:
+        if pos + 4 > len(jpeg_data) or jpeg_data[pos] != 0xFF:
+            raise ValueError("corrupt or truncated JPEG header")
+        marker = jpeg_data[pos + 1]
+        if marker == 0xFF: # Fill byte
+            pos += 1
+            continue
+        length = int.from_bytes(jpeg_data[pos + 2 : pos + 4], "big")
+        segment = jpeg_data[pos + 4 : pos + 2 + length]
+        if length < 2 or len(segment) != length - 2:
+            raise ValueError("corrupt or truncated JPEG header")
+
+        if marker == 0xDB: # DQT: one or more quantization tables
+            i = 0
+            while i < len(segment):
+                precision, table_id = segment[i] >> 4, segment[i] & 0x0F
+                table_size = 128 if precision else 64
+                if i + 1 + table_size > len(segment):
+                    raise ValueError("truncated quantization table")
+                quant_tables[table_id] = (precision, segment[i + 1 : i + 1 + table_size])
+                i += 1 + table_size
+        elif marker == 0xC0: # SOF0: baseline frame header
+            frame_header = segment
+        elif 0xC1 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            raise ValueError("only baseline JPEG is supported")
+        elif marker == 0xDD: # DRI: restart interval
+            if len(segment) < 2:
+                raise ValueError("truncated restart interval")
+            restart_interval = int.from_bytes(segment[:2], "big")
+        elif marker == 0xDA: # SOS: entropy-coded data follows this segment
+            scan_start = pos + 2 + length
+            break
+        pos += 2 + length
+
+    if frame_header is None:
+        raise ValueError("JPEG has no baseline frame header")
+    if len(frame_header) < 6 or len(frame_header) < 6 + 3 * frame_header[5]:
+        raise ValueError("truncated frame header")
+    height = int.from_bytes(frame_header[1:3], "big")
+    width = int.from_bytes(frame_header[3:5], "big")
+    components = [frame_header[6 + 3 * i : 9 + 3 * i] for i in range(frame_header[5])]
+    if width > JPEG_MAX_DIMENSION or height > JPEG_MAX_DIMENSION:
+        raise ValueError(f"{width}x{height} exceeds the RFC 2435 limit of {JPEG_MAX_DIMENSION}x{JPEG_MAX_DIMENSION}")
+    if len(components) != 3 or components[1][1] != 0x11 or components[2][1] != 0x11:
+        raise ValueError("only 3-component YUV JPEGs are supported")
+    if components[0][1] == 0x21:
+        rfc_type = 0 # 4:2:2
+    elif components[0][1] == 0x22:
+        rfc_type = 1 # 4:2:0
+    else:
+        raise ValueError("only 4:2:2 and 4:2:0 chroma subsampling are supported")
+    if restart_interval:
+        rfc_type += 64
+
+    # Luma table followed by chroma table, with one precision bit per table.
+    if components[0][2] not in quant_tables or components[1][2] not in quant_tables:
+        raise ValueError("JPEG is missing a quantization table")
+    luma_precision, luma_table = quant_tables[components[0][2]]
+    chroma_precision, chroma_table = quant_tables[components[1][2]]
+    tables = luma_table + chroma_table
+    quant_header = struct.pack("!BBH", 0, luma_precision | (chroma_precision << 1), len(tables)) + tables
+
+    return JpegInfo(rfc_type, width, height, restart_interval, quant_header, scan_start)
+
+def split_scan(scan_size, first_size, max_size):
+    """
+    Splits scan data without restart markers into RTP/JPEG packets of at most
+    first_size bytes for the first packet and max_size bytes for the others.
+    Returns a list of (offset, payload_size, restart_field); restart_field is 0.
+    """
+    fragments = []
+    offset = 0
+    payload_size = first_size
+    while offset < scan_size:
+        payload_size = min(payload_size, scan_size - offset)
+        fragments.append((offset, payload_size, 0))
+        offset += payload_size
+        payload_size = max_size
+    return fragments
+
+def split_scan_at_restarts(scan, first_size, max_size):
+    """
+    Splits scan data with restart markers into RTP/JPEG packets that start on
+    restart interval boundaries (RFC 2435 section 3.1.7). A packet carries either
+    as many whole restart intervals as fit, or one piece of an interval too large
+    for a single packet. Sizes are limited as for split_scan().
+    Returns a list of (offset, payload_size, restart_field), where restart_field
+    holds the F/L flags and the count of the packet's first restart interval.
+    """
+    # End offset of each restart interval, including its trailing RSTn marker.
+    interval_ends = [marker.end() for marker in RESTART_MARKER_RE.finditer(scan)]
+    if not interval_ends or interval_ends[-1] != len(scan):
+        interval_ends.append(len(scan))
+
+    fragments = []
+    offset = 0
+    interval = 0
+    room = first_size
+    while interval < len(interval_ends):
+        count = interval & JPEG_RESTART_COUNT_MASK
+        next_interval = bisect.bisect_right(interval_ends, offset + room, lo=interval)
+        if next_interval > interval:
+            # Whole restart intervals.
+            end = interval_ends[next_interval - 1]
+            fragments.append((offset, end - offset, JPEG_RESTART_FIRST | JPEG_RESTART_LAST | count))
+            offset = end
+            interval = next_interval
+        else:
+            # A single interval split across packets.
+            end = interval_ends[interval]
+            flags = JPEG_RESTART_FIRST
+            while offset < end:
+                payload_size = min(room, end - offset)
+                if offset + payload_size == end:
+                    flags |= JPEG_RESTART_LAST
+                fragments.append((offset, payload_size, flags | count))
+                offset += payload_size
+                flags = 0
+                room = max_size
+            interval += 1
+        room = max_size
+    return fragments
+
+def open_hw_jpeg_pipeline():
+    """
+    Starts the HW_ENCODE_PIPELINE GStreamer pipeline.
+    Returns (pipeline, appsink), or (None, None) if it is unavailable.
+    """
+    if Gst is None:
+        print("[RTP Stream] GStreamer Python bindings not found. Using OpenCV encoding instead.")
+        return None, None
+
+    try:
+        Gst.init(None)
+        pipeline = Gst.parse_launch(HW_ENCODE_PIPELINE)
+    except Exception as e:
+        print(f"[RTP Stream] Error creating hardware encoding pipeline: {e}. Using OpenCV encoding instead.")
+        return None, None
+
+    appsink = pipeline.get_by_name("sink")
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        print("[RTP Stream] Error: Could not start hardware encoding pipeline. Using OpenCV encoding instead.")
+        pipeline.set_state(Gst.State.NULL)
+        return None, None
+
+    print("[RTP Stream] Using GStreamer hardware JPEG encoding.")
+    return pipeline, appsink
+
+def pull_hw_jpeg(appsink):
+    """
+    Pulls the next encoded JPEG frame from the appsink as bytes, or None at end of stream.
+    """
+    sample = appsink.emit('pull-sample')
+    if sample is None:
+        return None
+    buf = sample.get_buffer()
+    ok, map_info = buf.map(Gst.MapFlags.READ)
+    if not ok:
+        return None
+    try:
+        return bytes(map_info.data)
+    finally:
+        buf.unmap(map_info)
+
+def put_dropping_oldest(frame_queue, item, on_drop=None):
+    """
+    Puts item on a bounded queue, discarding the oldest entries while it is full.
+    on_drop, if given, is called with each discarded entry.
+    """
+    while True:
+        try:
+            frame_queue.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                dropped = frame_queue.get_nowait()
+            except queue.Empty:
+                continue
+            if on_drop is not None:
+                on_drop(dropped)
+
+def recycle_frame(free_frames, frame):
+    """
+    Returns a raw frame buffer to the free-list for reuse by the capture thread.
+    """
+    try:
+        free_frames.put_nowait(frame)
+    except queue.Full:
+        pass # Pool is already full; let this buffer be garbage collected
+
+def create_frame_pool(cap):
+    """
+    Creates the free-list of raw frame buffers, preallocated at the capture size
+    when the source reports it.
+    """
+    free_frames = queue.Queue(maxsize=FRAME_POOL_SIZE)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    if width > 0 and height > 0:
+        for _ in range(FRAME_POOL_SIZE):
+            free_frames.put_nowait(np.empty((height, width, 3), dtype=np.uint8))
+    return free_frames
+
+def capture_frames(cap, raw_frames, free_frames):
+    """
+    Captures frames at up to TARGET_FPS and queues them as (frame, capture_ns).
+    Frames are decoded into buffers taken from free_frames.
+    Runs in its own thread while streaming is active.
+    """
+    frame_interval = 1.0 / TARGET_FPS
+    # Frames are retrieved on a fixed schedule of one per frame_interval rather than
+    # by the time since the last retrieved frame, so a source running at exactly
+    # TARGET_FPS is not thinned out by its timing jitter.
+    schedule_tolerance = frame_interval * FRAME_SCHEDULE_TOLERANCE
+    next_due = None
+    # Only video files are paced by sleeping. A live camera keeps grabbing: while
+    # we slept, its frames would queue up in the driver and every grab() would
+    # return an old buffered frame instead of skipping to a fresh one.
+    is_file = cap.get(cv2.CAP_PROP_FRAME_COUNT) > 0
+    drop_frame = lambda item: recycle_frame(free_frames, item[0])
+
+    while streaming_active.is_set():
+        # grab() only advances the stream; the expensive decode happens in retrieve(),
+        # which we skip for frames that arrive ahead of schedule.
+        if not cap.grab():
+            print("[RTP Stream] Error: Could not read frame or end of video stream reached. Stopping RTP stream.")
+            streaming_active.clear()
+            break
+        capture_ns = time.monotonic_ns()
+
+        now = time.monotonic()
+        if next_due is not None and now < next_due - schedule_tolerance:
+            continue
+
+        # Decode into a recycled buffer. OpenCV allocates a new array instead if
+        # none is free or its size doesn't match; that array then joins the pool.
+        try:
+            buffer = free_frames.get_nowait()
+        except queue.Empty:
+            buffer = None
+        ret, frame = cap.retrieve(buffer)
+        if not ret:
+            print("[RTP Stream] Error: Could not decode frame. Stopping RTP stream.")
+            streaming_active.clear()
+            break
+        put_dropping_oldest(raw_frames, (frame, capture_ns), on_drop=drop_frame)
+
+        # Start the schedule at the first frame, and restart it after a stall
+        # instead of retrieving a burst of frames to catch up.
+        if next_due is None or now - next_due >= frame_interval:
+            next_due = now
+        next_due += frame_interval
+
+        # Wait for the next slot so video files are not read faster than TARGET_FPS.
+        if is_file:
+            sleep_s = next_due - time.monotonic()
+            if sleep_s > 0 and streaming_stopped.wait(timeout=sleep_s):
+                break
+
+    put_dropping_oldest(raw_frames, END_OF_STREAM, on_drop=drop_frame)
+
+def fit_frame_size(frame):
+    """
+    Downscales a frame larger than JPEG_MAX_DIMENSION in either direction to fit,
+    keeping its aspect ratio. Smaller frames are returned as they are.
+    """
+    height, width = frame.shape[:2]
+    scale = JPEG_MAX_DIMENSION / max(width, height)
+    if scale >= 1:
+        return frame
+    size = (max(1, int(width * scale)), max(1, int(height * scale)))
+    return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+def encode_frames(raw_frames, jpeg_frames, free_frames):
+    """
+    Encodes queued raw frames to JPEG and queues them as (jpeg_data, capture_ns).
+    Frames too large for RTP/JPEG are downscaled first.
+    Raw frame buffers are returned to free_frames once encoded.
+    Runs in its own thread while streaming is active.
+    """
+    while streaming_active.is_set():
+        try:
+            item = raw_frames.get(timeout=FRAME_QUEUE_POLL_TIMEOUT)
+        except queue.Empty:
+            continue
+        if item is END_OF_STREAM:
+            break
+        frame, capture_ns = item
+        try:
+            jpeg_data = encode_jpeg(fit_frame_size(frame))
+        except Exception as e:
+            print(f"[RTP Stream] Error encoding frame: {e}. Stopping RTP stream.")
+            streaming_active.clear()
+            break
+        recycle_frame(free_frames, frame)
+        put_dropping_oldest(jpeg_frames, (jpeg_data, capture_ns))
+
+    put_dropping_oldest(jpeg_frames, END_OF_STREAM)
+
+def pull_hw_frames(appsink, jpeg_frames):
+    """
+    Queues JPEG frames from the hardware encoding pipeline as (jpeg_data, capture_ns).
+    Runs in its own thread while streaming is active.
+    """
+    while streaming_active.is_set():
+        jpeg_data = pull_hw_jpeg(appsink)
+        if jpeg_data is None:
+            if streaming_active.is_set():
+                print("[RTP Stream] Error: Hardware encoding pipeline stopped producing frames. Stopping RTP stream.")
+                streaming_active.clear()
+            break
+        put_dropping_oldest(jpeg_frames, (jpeg_data, time.monotonic_ns()))
+
+    put_dropping_oldest(jpeg_frames, END_OF_STREAM)
 
 def rtp_stream_video():
     """
     Captures video frames, encodes them, packetizes them into RTP, and sends them over UDP.
-    This function runs in a separate thread when streaming is active.
+    This function runs in a separate thread when streaming is active. Capture and
+    encoding run in their own worker threads; this thread packetizes and sends.
     """
-    global streaming_active
+    cap = None
+    hw_pipeline, hw_sink = None, None
+    if USE_HW_ENCODE:
+        hw_pipeline, hw_sink = open_hw_jpeg_pipeline()
 
-    print(f"[RTP Stream] Attempting to open video source {VIDEO_SOURCE}...")
-    cap = cv2.VideoCapture(VIDEO_SOURCE)
-    if not cap.isOpened():
-        print(f"[RTP Stream] Error: Could not open video source {VIDEO_SOURCE}.")
-        print("[RTP Stream] Please check if a webcam is connected, if it's in use by another application, or if the video file path is correct.")
-        streaming_active = False
-        return # Exit the streaming thread gracefully
+    if hw_pipeline is None:
+        print(f"[RTP Stream] Attempting to open video source {VIDEO_SOURCE}...")
+        cap = cv2.VideoCapture(VIDEO_SOURCE)
+        if not cap.isOpened():
+            print(f"[RTP Stream] Error: Could not open video source {VIDEO_SOURCE}.")
+            print("[RTP Stream] Please check if a webcam is connected, if it's in use by another application, or if the video file path is correct.")
+            streaming_active.clear()
+            return # Exit the streaming thread gracefully
 
     rtp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rtp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, RTP_SEND_BUFFER_SIZE)
+    if hasattr(socket, "IP_MTU_DISCOVER"): # Linux only
+        # IP_PMTUDISC_DO: set Don't Fragment so oversized packets fail instead of being fragmented.
+        rtp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER, 2)
+    rtp_socket.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, RTP_IP_TOS)
+    if hasattr(socket, "SO_PRIORITY"): # Linux only
+        rtp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_PRIORITY, RTP_SOCKET_PRIORITY)
+    # The socket is left unconnected (see set_destination()); the sendmmsg() headers
+    # carry the destination, packed once.
+    rtp_destination = ('127.0.0.1', RTP_PORT)
     print(f"[RTP Stream] RTP streaming thread started. Sending on UDP port {RTP_PORT}...")
 
     sequence_number = 0
     ssrc = 0x12345678
-    start_time = time.time()
+    start_ns = time.monotonic_ns()
 
-    while streaming_active:
-        ret, frame = cap.read()
-        if not ret:
-            print("[RTP Stream] Error: Could not read frame or end of video stream reached. Stopping RTP stream.")
-            streaming_active = False
-            break
+    # One sendmmsg() batch worth of RTP + JPEG headers, reused for every frame.
+    # The JPEG type/size fields only change when the stream's JPEG headers do; per
+    # packet only the RTP fields and fragment offset are rewritten. Scan data is
+    # never copied: each packet is sent as a (headers, JPEG slice) gather list.
+    header_buf = bytearray(SEND_BATCH_SIZE * RTP_JPEG_HEADER_SLOT_SIZE)
+    header_view = memoryview(header_buf)
+    # With the compiled packetizer, whole packets are built in C instead.
+    packet_batch = create_packet_batch(rtp_destination) if rtp_pack is not None else None
+    # rtp_pack does not align packets to restart intervals, so frames with restart
+    # markers always take the pure Python path.
+    gather_batch = create_gather_batch(rtp_destination)
+
+    # Zero-copy only applies to the gather path; the compiled path sends from its
+    # own reused packet buffers.
+    use_zerocopy = (
+        packet_batch is None
+        and MAX_PACKET_SIZE - RTP_JPEG_HEADER_SLOT_SIZE >= ZEROCOPY_MIN_PAYLOAD
+        and enable_zerocopy(rtp_socket)
+    )
+    send_flags = MSG_ZEROCOPY if use_zerocopy else 0
+    zerocopy_sends = 0 # The kernel numbers zero-copy sends from 0
+    # (last send id, buffers the kernel may still read) for each zero-copy batch.
+    zerocopy_pending = deque()
+    jpeg_info = None
+    jpeg_header_bytes = None # JPEG headers of the last parsed frame
+    pack_rtp_jpeg_header = RTP_JPEG_HEADER.pack_into
+    pack_restart_field = JPEG_RESTART_FIELD.pack_into
 
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), JPEG_QUALITY]
-        _, encoded_frame = cv2.imencode('.jpg', frame, encode_param)
-        jpeg_data = encoded_frame.tobytes()
+    # Capture -> encode -> send pipeline, so the three stages overlap.
+    jpeg_frames = queue.Queue(maxsize=JPEG_FRAME_QUEUE_SIZE)
+    if hw_sink is not None:
+        # The GPU pipeline delivers ready-made JPEG frames.
+        workers = [threading.Thread(target=pull_hw_frames, args=(hw_sink, jpeg_frames))]
+    else:
+        raw_frames = queue.Queue(maxsize=RAW_FRAME_QUEUE_SIZE)
+        free_frames = create_frame_pool(cap)
+        workers = [
+            threading.Thread(target=capture_frames, args=(cap, raw_frames, free_frames)),
+            threading.Thread(target=encode_frames, args=(raw_frames, jpeg_frames, free_frames)),
+        ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
 
-        timestamp = int((time.time() - start_time) * 90000)
+    # Pin only the sending thread; the workers started above would otherwise
+    # inherit the affinity and end up sharing this one core.
+    rtp_cpu = os.environ.get('RTP_CPU')
+    if rtp_cpu and hasattr(os, "sched_setaffinity"): # Linux only
+        try:
+            cpu = int(rtp_cpu)
+            if cpu not in os.sched_getaffinity(0):
+                raise ValueError(f"CPU {cpu} is not available to this process")
+            os.sched_setaffinity(0, {cpu})
+            print(f"[RTP Stream] RTP sending thread pinned to CPU {cpu}.")
+        except (OSError, ValueError) as e:
+            print(f"[RTP Stream] Warning: Could not pin RTP sending thread to RTP_CPU={rtp_cpu}: {e}")
 
-        offset = 0
-        while offset < len(jpeg_data):
-            # Corrected payload_size calculation: MAX_PACKET_SIZE minus header size
-            payload_size = min(len(jpeg_data) - offset, MAX_PACKET_SIZE - RTP_HEADER_SIZE)
-            if payload_size <= 0:
-                break
+    while streaming_active.is_set():
+        try:
+            item = jpeg_frames.get(timeout=FRAME_QUEUE_POLL_TIMEOUT)
+        except queue.Empty:
+            continue
+        if item is END_OF_STREAM:
+            break
+        jpeg_data, capture_ns = item
 
-            header = create_rtp_header(sequence_number, timestamp, ssrc)
-            rtp_packet = header + jpeg_data[offset : offset + payload_size]
+        # 90 kHz RTP clock from the monotonic clock, in integer math:
+        # ns * 90000 / 1e9 == ns * 9 // 100000.
+        timestamp = ((capture_ns - start_ns) * 9 // 100000) & 0xFFFFFFFF
 
+        # Frames from the same encoder normally share identical JPEG headers, so
+        # they are only parsed again when they change.
+        if jpeg_header_bytes is None or not jpeg_data.startswith(jpeg_header_bytes):
             try:
-                rtp_socket.sendto(rtp_packet, ('127.0.0.1', RTP_PORT))
-            except Exception as e:
-                print(f"[RTP Stream] Error sending RTP packet: {e}")
-                streaming_active = False
+                jpeg_info = parse_jpeg(jpeg_data)
+            except ValueError as e:
+                print(f"[RTP Stream] Error: Cannot packetize JPEG frame: {e}. Stopping RTP stream.")
+                streaming_active.clear()
                 break
+            jpeg_header_bytes = jpeg_data[:jpeg_info.scan_start]
+            for slot in range(0, len(header_buf), RTP_JPEG_HEADER_SLOT_SIZE):
+                struct.pack_into(
+                    "!BBBBHH", header_buf, slot + RTP_HEADER_SIZE + 4,
+                    jpeg_info.rfc_type, JPEG_Q_DYNAMIC_TABLES,
+                    (jpeg_info.width + 7) // 8, (jpeg_info.height + 7) // 8,
+                    # Restart header; the F/L flags and count are written per packet.
+                    jpeg_info.restart_interval, 0,
+                )
+            header_size = RTP_HEADER_SIZE + JPEG_HEADER_SIZE
+            if jpeg_info.restart_interval:
+                header_size += JPEG_RESTART_HEADER_SIZE
+            max_payload_size = MAX_PACKET_SIZE - header_size
+            # JPEG header bytes after the fragment offset, for the compiled packetizer.
+            jpeg_header_tail = bytes(header_view[RTP_HEADER_SIZE + 4 : header_size])
+
+        # Only the entropy-coded scan data is sent; the EOI marker is implied.
+        scan_end = len(jpeg_data) - 2 if jpeg_data.endswith(b"\xff\xd9") else len(jpeg_data)
+        scan_view = memoryview(jpeg_data)[jpeg_info.scan_start : scan_end]
+        scan_size = len(scan_view)
 
-            offset += payload_size
-            sequence_number += 1
-            if sequence_number > 65535:
-                sequence_number = 0
-            time.sleep(0.001)
+        try:
+            if packet_batch is not None and not jpeg_info.restart_interval:
+                # Compiled path: one packetize() call and one send per batch.
+                offset = 0
+                while offset < scan_size:
+                    count, offset, sequence_number = rtp_pack.packetize(
+                        scan_view, offset, jpeg_info.quant_header, jpeg_header_tail,
+                        packet_batch.packets, packet_batch.lengths,
+                        sequence_number, timestamp, ssrc, RTP_PAYLOAD_TYPE_JPEG,
+                    )
+                    send_packet_batch(rtp_socket, packet_batch, count, rtp_destination)
+            else:
+                # Pure Python path: fill the header slots and hand the kernel a full
+                # batch of (headers, quantization tables, payload) gather lists at a time.
+                if gather_batch is not None:
+                    # iovecs are filled in by address arithmetic from the base of each
+                    # buffer, looked up once per frame rather than once per part.
+                    header_address = buffer_address(header_buf)
+                    quant_address = buffer_address(jpeg_info.quant_header)
+                    scan_address = buffer_address(jpeg_data) + jpeg_info.scan_start
+                    iov_fields = []
+                else:
+                    rtp_packets = []
+                batch_count = 0
+                first_payload_size = max_payload_size - len(jpeg_info.quant_header)
+                if jpeg_info.restart_interval:
+                    fragments = split_scan_at_restarts(scan_view, first_payload_size, max_payload_size)
+                else:
+                    fragments = split_scan(scan_size, first_payload_size, max_payload_size)
+                for offset, payload_size, restart_field in fragments:
+                    quant_size = len(jpeg_info.quant_header) if offset == 0 else 0
+                    last_packet = offset + payload_size == scan_size
+                    marker_payload_type = RTP_PAYLOAD_TYPE_JPEG | (RTP_MARKER_BIT if last_packet else 0)
+                    slot = batch_count * RTP_JPEG_HEADER_SLOT_SIZE
+
+                    pack_rtp_jpeg_header(
+                        header_buf, slot,
+                        RTP_VERSION_BYTE, marker_payload_type, sequence_number, timestamp, ssrc, offset,
+                    )
+                    if restart_field:
+                        pack_restart_field(header_buf, slot + RTP_HEADER_SIZE + JPEG_HEADER_SIZE + 2, restart_field)
+                    if gather_batch is not None:
+                        iov_fields += (
+                            header_address + slot, header_size,
+                            quant_address, quant_size,
+                            scan_address + offset, payload_size,
+                        )
+                    else:
+                        headers = header_view[slot : slot + header_size]
+                        payload = scan_view[offset : offset + payload_size]
+                        if offset == 0:
+                            rtp_packets.append((headers, jpeg_info.quant_header, payload))
+                        else:
+                            rtp_packets.append((headers, payload))
+                    batch_count += 1
+                    sequence_number = (sequence_number + 1) & 0xFFFF
+
+                    if batch_count == SEND_BATCH_SIZE or last_packet:
+                        if gather_batch is not None:
+                            send_gather_batch(rtp_socket, gather_batch, iov_fields, send_flags)
+                            iov_fields.clear()
+                        else:
+                            send_rtp_packets(rtp_socket, rtp_packets, rtp_destination)
+                            rtp_packets.clear()
+                        if use_zerocopy:
+                            # The kernel may still read this batch's headers and payload:
+                            # keep them alive until it reports completion, and carry on
+                            # in a fresh copy of the header buffer.
+                            zerocopy_sends += batch_count
+                            zerocopy_pending.append((zerocopy_sends - 1, header_buf, jpeg_data, jpeg_info.quant_header))
+                            header_buf = bytearray(header_buf)
+                            header_view = memoryview(header_buf)
+                            header_address = buffer_address(header_buf)
+                        batch_count = 0
+
+                if zerocopy_pending:
+                    completed = read_zerocopy_completions(rtp_socket)
+                    while zerocopy_pending and completed is not None and zerocopy_pending[0][0] <= completed:
+                        zerocopy_pending.popleft()
+        except Exception as e:
+            print(f"[RTP Stream] Error sending RTP packets: {e}")
+            streaming_active.clear()
+            break
 
     print("[RTP Stream] RTP streaming thread stopped.")
-    cap.release()
+    streaming_active.clear() # Stop the worker threads as well
+    if hw_pipeline is not None:
+        hw_pipeline.set_state(Gst.State.NULL) # Unblocks a pending pull-sample
+    for worker in workers:
+        worker.join(timeout=5)
+    if cap is not None:
+        cap.release()
     rtp_socket.close()
 
-def handle_rtsp_client(client_socket, client_address):
+# --- RTSP Request Parsing ---
+# Matches the request method and CSeq header in a single pass over the raw bytes.
+# CSeq is optional; requests without one are answered with RTSP_DEFAULT_CSEQ.
+RTSP_REQUEST_RE = re.compile(
+    rb'^(OPTIONS|DESCRIBE|SETUP|PLAY|TEARDOWN)[^\r]*(?:\r\n(?:[^\r]+\r\n)*?CSeq:\s*(\d+))?',
+    re.IGNORECASE,
+)
+RTSP_DEFAULT_CSEQ = b"1"
+# End of an RTSP request's headers. Requests can arrive split across several
+# recv() calls, or several in one, so bytes are buffered per client until then.
+RTSP_REQUEST_END = b"\r\n\r\n"
+# A request line without an RTSP version (e.g. a bare "PLAY" typed into a simple
+# client) is a complete request on its own, ending at the end of the line.
+RTSP_VERSION_MARKER = b" RTSP/"
+
+def find_rtsp_request_end(buffer):
+    """
+    Returns the length of the first complete request in buffer, or -1 if more
+    data is needed.
+    """
+    line_end = buffer.find(b"\n")
+    if line_end < 0:
+        return -1
+    if buffer.find(RTSP_VERSION_MARKER, 0, line_end) < 0:
+        return line_end + 1
+    end = buffer.find(RTSP_REQUEST_END)
+    return -1 if end < 0 else end + len(RTSP_REQUEST_END)
+# Used only to echo the CSeq back in error responses.
+RTSP_CSEQ_RE = re.compile(rb'^CSeq:\s*(\d+)', re.IGNORECASE | re.MULTILINE)
+
+# --- RTSP Response Templates ---
+# Responses only differ by the CSeq value, so they are prebuilt as bytes and sent
+# as (prefix, cseq, suffix) with the CSeq bytes taken straight from the request.
+RTSP_OK_PREFIX = b"RTSP/1.0 200 OK\r\nCSeq: "
+RTSP_BAD_REQUEST_PREFIX = b"RTSP/1.0 400 Bad Request\r\nCSeq: "
+RTSP_SETUP_SUFFIX = (
+    f"\r\nTransport: RTP/AVP;unicast;client_port={RTP_PORT}-{RTP_PORT+1}\r\n"
+    f"Session: 12345678\r\n\r\n"
+).encode('utf-8')
+RTSP_PLAY_SUFFIX = b"\r\nSession: 12345678\r\n\r\n"
+RTSP_TEARDOWN_SUFFIX = b"\r\n\r\n"
+RTSP_OPTIONS_SUFFIX = b"\r\nPublic: DESCRIBE, SETUP, TEARDOWN, PLAY, PAUSE, OPTIONS\r\n\r\n"
+RTSP_BAD_REQUEST_SUFFIX = b"\r\n\r\n"
+
+def build_describe_suffix():
+    """
+    Builds the DESCRIBE response headers after CSeq, followed by the SDP description.
+    """
+    payload_type_jpeg = 26
+    sdp_payload = (
+        "v=0\r\n"
+        f"o=- 0 0 IN IP4 127.0.0.1\r\n"
+        "s=RTSP Stream\r\n"
+        "t=0 0\r\n"
+        f"a=control:rtsp://127.0.0.1:{RTSP_PORT}/stream\r\n"
+        f"m=video 0 RTP/AVP {payload_type_jpeg}\r\n"
+        f"a=rtpmap:{payload_type_jpeg} JPEG/90000\r\n"
+        f"a=control:streamid=0\r\n"
+    )
+    response_headers = (
+        f"\r\n"
+        f"Content-Type: application/sdp\r\n"
+        f"Content-Length: {len(sdp_payload)}\r\n"
+        f"\r\n"
+    )
+    return (response_headers + sdp_payload).encode('utf-8')
+
+RTSP_DESCRIBE_SUFFIX = build_describe_suffix()
+
+def send_rtsp_response(client_socket, prefix, cseq, suffix):
+    """
+    Sends an RTSP response assembled from its parts in a single gather write.
+    """
+    if not hasattr(client_socket, "sendmsg"): # Windows has no sendmsg()
+        client_socket.sendall(prefix + cseq + suffix)
+        return
+    sent = client_socket.sendmsg([prefix, cseq, suffix])
+    if sent < len(prefix) + len(cseq) + len(suffix):
+        client_socket.sendall((prefix + cseq + suffix)[sent:])
+
+def handle_setup(client_socket, client_address, cseq):
+    """
+    Responds to SETUP with the RTP transport and session.
+    """
+    print(f"[RTSP Control] Sending SETUP response to {client_address}")
+    send_rtsp_response(client_socket, RTSP_OK_PREFIX, cseq, RTSP_SETUP_SUFFIX)
+
+def start_rtp_stream(previous_thread):
+    """
+    Runs a new RTP stream once previous_thread (the last stream, possibly still
+    shutting down after a TEARDOWN) has finished. The streams share the global
+    flags, and the previous one has to release the video source first.
+    Runs in its own thread, so the RTSP selector loop never waits for this.
+    """
+    global rtp_start_pending
+
+    if previous_thread is not None and previous_thread.is_alive():
+        print("[RTP Stream] Waiting for the previous RTP streaming thread to finish...")
+        previous_thread.join(timeout=5)
+        if previous_thread.is_alive():
+            print("[RTP Stream] Warning: Previous RTP thread is taking long to terminate. Still waiting...")
+            previous_thread.join()
+
+    with streaming_lock:
+        rtp_start_pending = False
+        if streaming_stopped.is_set():
+            print("[RTP Stream] Stream was torn down before it started.")
+            return
+        streaming_active.set()
+    rtp_stream_video()
+
+def handle_play(client_socket, client_address, cseq):
+    """
+    Starts a new RTP stream (if one is not already running or starting) and
+    responds to PLAY.
+    """
+    global rtp_thread, rtp_start_pending
+
+    with streaming_lock:
+        if streaming_active.is_set() or rtp_start_pending:
+            print("[RTSP Control] PLAY command received, but RTP stream is already active.")
+            # Undo a TEARDOWN received while the stream was still starting.
+            streaming_stopped.clear()
+        else:
+            print("[RTSP Control] PLAY command received. Starting RTP stream thread...")
+            rtp_start_pending = True
+            streaming_stopped.clear()
+            rtp_thread = threading.Thread(target=start_rtp_stream, args=(rtp_thread,))
+            rtp_thread.daemon = True
+            rtp_thread.start()
+
+    print(f"[RTSP Control] Sending PLAY response to {client_address}")
+    send_rtsp_response(client_socket, RTSP_OK_PREFIX, cseq, RTSP_PLAY_SUFFIX)
+
+def handle_teardown(client_socket, client_address, cseq):
+    """
+    Signals the RTP streaming thread to stop and responds to TEARDOWN.
+    The thread is not waited for here, which would hold up every other client of
+    the selector loop; the next stream or the server shutdown waits for it instead.
+    """
+    print("[RTSP Control] TEARDOWN command received. Stopping RTP stream...")
+    with streaming_lock:
+        streaming_active.clear()
+        streaming_stopped.set()
+    print(f"[RTSP Control] Sending TEARDOWN response to {client_address}")
+    send_rtsp_response(client_socket, RTSP_OK_PREFIX, cseq, RTSP_TEARDOWN_SUFFIX)
+
+def handle_describe(client_socket, client_address, cseq):
+    """
+    Responds to DESCRIBE with the SDP description of the stream.
+    """
+    full_response = (RTSP_OK_PREFIX + cseq + RTSP_DESCRIBE_SUFFIX).decode('utf-8')
+    print(f"[RTSP Control] Sending DESCRIBE response with SDP to {client_address}:\n{full_response.strip()}")
+    send_rtsp_response(client_socket, RTSP_OK_PREFIX, cseq, RTSP_DESCRIBE_SUFFIX)
+
+def handle_options(client_socket, client_address, cseq):
+    """
+    Responds to OPTIONS with the list of supported methods.
+    """
+    print(f"[RTSP Control] Sending OPTIONS response to {client_address}")
+    send_rtsp_response(client_socket, RTSP_OK_PREFIX, cseq, RTSP_OPTIONS_SUFFIX)
+
+def handle_bad_request(client_socket, client_address, data):
+    """
+    Responds with 400 Bad Request to requests that are not recognised.
+    """
+    cseq_match = RTSP_CSEQ_RE.search(data)
+    cseq = cseq_match.group(1) if cseq_match else RTSP_DEFAULT_CSEQ
+    print(f"[RTSP Control] Unknown command received: {data.decode('utf-8', 'replace').strip()}")
+    send_rtsp_response(client_socket, RTSP_BAD_REQUEST_PREFIX, cseq, RTSP_BAD_REQUEST_SUFFIX)
+
+RTSP_METHOD_HANDLERS = {
+    b'OPTIONS': handle_options,
+    b'DESCRIBE': handle_describe,
+    b'SETUP': handle_setup,
+    b'PLAY': handle_play,
+    b'TEARDOWN': handle_teardown,
+}
+
+# State kept for each connected RTSP client.
+RtspClient = namedtuple("RtspClient", [
+    "socket",
+    "address",
+    "buffer",     # bytearray of received bytes not yet handled as a request
+])
+
+def accept_rtsp_client(server_socket):
+    """
+    Accepts a new RTSP client and registers it with the selector.
+    """
+    conn, addr = server_socket.accept()
+    conn.setblocking(False)
+    print(f"[RTSP Control] Accepted connection from {addr}")
+    rtsp_clients[conn.fileno()] = RtspClient(conn, addr, bytearray())
+    rtsp_selector.register(conn, selectors.EVENT_READ, handle_rtsp_client)
+
+def close_rtsp_client(client_socket):
+    """
+    Unregisters and closes an RTSP client connection.
+    """
+    client_address = rtsp_clients.pop(client_socket.fileno()).address
+    print(f"[RTSP Control] Closing client socket for {client_address}")
+    rtsp_selector.unregister(client_socket)
+    client_socket.close()
+
+def handle_rtsp_client(client_socket):
     """
-    Handles a single RTSP client connection.
+    Handles data from an RTSP client whose socket is ready to read, answering
+    each complete request received so far.
     This is a very basic, simplified RTSP server implementation, not a full RFC-compliant one.
     It primarily responds to SETUP, PLAY, and TEARDOWN commands.
     """
-    global streaming_active, rtp_thread, rtsp_client_socket, rtsp_client_address
-
-    print(f"[RTSP Control] Accepted connection from {client_address}")
-    rtsp_client_socket = client_socket
-    rtsp_client_address = client_address
+    client = rtsp_clients[client_socket.fileno()]
+    client_address = client.address
 
     try:
-        while True:
-            data = client_socket.recv(1024).decode('utf-8')
-            if not data:
-                print(f"[RTSP Control] Client {client_address} disconnected.")
-                break
+        data = client_socket.recv(1024)
+        if not data:
+            print(f"[RTSP Control] Client {client_address} disconnected.")
+            close_rtsp_client(client_socket)
+            return
+        client.buffer.extend(data)
 
-            print(f"[RTSP Control] Received from {client_address}:\n---BEGIN RTSP COMMAND---\n{data.strip()}\n---END RTSP COMMAND---")
-
-            response = ""
-            cseq = "1"
-            lines = data.split('\r\n')
-            for line in lines:
-                if line.startswith("CSeq:"):
-                    cseq = line.split(":")[1].strip()
-                    break
-
-            if "SETUP" in data:
-                response = (
-                    f"RTSP/1.0 200 OK\r\n"
-                    f"CSeq: {cseq}\r\n"
-                    f"Transport: RTP/AVP;unicast;client_port={RTP_PORT}-{RTP_PORT+1}\r\n"
-                    f"Session: 12345678\r\n\r\n"
-                )
-                print(f"[RTSP Control] Sending SETUP response to {client_address}")
-                client_socket.sendall(response.encode('utf-8'))
-
-            elif "PLAY" in data:
-                if not streaming_active:
-                    print("[RTSP Control] PLAY command received. Starting RTP stream thread...")
-                    global rtp_thread # Ensure global reference is used
-                    streaming_active = True
-                    rtp_thread = threading.Thread(target=rtp_stream_video)
-                    rtp_thread.daemon = True
-                    rtp_thread.start()
-                else:
-                    print("[RTSP Control] PLAY command received, but RTP stream is already active.")
+        while True:
+            # Blank lines between requests are ignored.
+            del client.buffer[: len(client.buffer) - len(client.buffer.lstrip(b"\r\n"))]
+            end = find_rtsp_request_end(client.buffer)
+            if end < 0:
+                if len(client.buffer) > RTSP_MAX_REQUEST_SIZE:
+                    print(f"[RTSP Control] Request from {client_address} exceeds {RTSP_MAX_REQUEST_SIZE} bytes.")
+                    close_rtsp_client(client_socket)
+                return # Wait for the rest of the request
+            data = bytes(client.buffer[:end])
+            del client.buffer[:end]
 
-                response = (
-                    f"RTSP/1.0 200 OK\r\n"
-                    f"CSeq: {cseq}\r\n"
-                    f"Session: 12345678\r\n\r\n"
-                )
-                print(f"[RTSP Control] Sending PLAY response to {client_address}")
-                client_socket.sendall(response.encode('utf-8'))
-
-            elif "TEARDOWN" in data:
-                print("[RTSP Control] TEARDOWN command received. Stopping RTP stream...")
-                streaming_active = False
-                if rtp_thread and rtp_thread.is_alive():
-                    print("[RTSP Control] Waiting for RTP streaming thread to finish...")
-                    rtp_thread.join(timeout=5)
-                    if rtp_thread.is_alive():
-                        print("[RTSP Control] Warning: RTP thread did not terminate gracefully within timeout.")
-                response = (
-                    f"RTSP/1.0 200 OK\r\n"
-                    f"CSeq: {cseq}\r\n\r\n"
-                )
-                print(f"[RTSP Control] Sending TEARDOWN response to {client_address}")
-                client_socket.sendall(response.encode('utf-8'))
-                break
+            print(f"[RTSP Control] Received from {client_address}:\n---BEGIN RTSP COMMAND---\n{data.decode('utf-8', 'replace').strip()}\n---END RTSP COMMAND---")
 
-            elif "DESCRIBE" in data:
-                payload_type_jpeg = 26
-                sdp_payload = (
-                    "v=0\r\n"
-                    f"o=- 0 0 IN IP4 127.0.0.1\r\n"
-                    "s=RTSP Stream\r\n"
-                    "t=0 0\r\n"
-                    f"a=control:rtsp://127.0.0.1:{RTSP_PORT}/stream\r\n"
-                    f"m=video 0 RTP/AVP {payload_type_jpeg}\r\n"
-                    f"a=rtpmap:{payload_type_jpeg} JPEG/90000\r\n"
-                    f"a=control:streamid=0\r\n"
-                )
+            request = RTSP_REQUEST_RE.match(data)
+            if request is None:
+                handle_bad_request(client_socket, client_address, data)
+                continue
 
-                response_headers = (
-                    f"RTSP/1.0 200 OK\r\n"
-                    f"CSeq: {cseq}\r\n"
-                    f"Content-Type: application/sdp\r\n"
-                    f"Content-Length: {len(sdp_payload)}\r\n"
-                    f"\r\n"
-                )
-                full_response = response_headers + sdp_payload
-                print(f"[RTSP Control] Sending DESCRIBE response with SDP to {client_address}:\n{full_response.strip()}")
-                client_socket.sendall(full_response.encode('utf-8'))
-
-            elif "OPTIONS" in data:
-                response = (
-                    f"RTSP/1.0 200 OK\r\n"
-                    f"CSeq: {cseq}\r\n"
-                    f"Public: DESCRIBE, SETUP, TEARDOWN, PLAY, PAUSE, OPTIONS\r\n\r\n"
-                )
-                print(f"[RTSP Control] Sending OPTIONS response to {client_address}")
-                client_socket.sendall(response.encode('utf-8'))
-
-            else:
-                print(f"[RTSP Control] Unknown command received: {data.strip()}")
-                response = (
-                    f"RTSP/1.0 400 Bad Request\r\n"
-                    f"CSeq: {cseq}\r\n\r\n"
-                )
-                client_socket.sendall(response.encode('utf-8'))
+            method = request.group(1).upper()
+            cseq = request.group(2) or RTSP_DEFAULT_CSEQ # Raw bytes, echoed back as-is
+            RTSP_METHOD_HANDLERS[method](client_socket, client_address, cseq)
+            if method == b'TEARDOWN':
+                close_rtsp_client(client_socket)
+                return
 
     except ConnectionResetError:
         print(f"[RTSP Control] Client {client_address} forcibly closed the connection.")
+        close_rtsp_client(client_socket)
     except Exception as e:
         print(f"[RTSP Control] Error handling client {client_address}: {e}")
-    finally:
-        print(f"[RTSP Control] Closing client socket for {client_address}")
-        client_socket.close()
-        rtsp_client_socket = None
-        rtsp_client_address = None
+        close_rtsp_client(client_socket)
 
 def start_rtsp_server_thread():
     """
     Initializes and starts the RTSP control server (TCP listener).
-    This function runs in a separate thread.
+    This function runs in a separate thread and serves every client from a
+    single selector loop instead of one thread per client.
     """
-    global rtsp_server_socket, rtsp_server_thread # Declare global for modification
+    global rtsp_server_socket, rtsp_selector # Declare global for modification
     try:
         rtsp_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         rtsp_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         rtsp_server_socket.bind(('0.0.0.0', RTSP_PORT))
-        rtsp_server_socket.listen(1)
+        rtsp_server_socket.listen(socket.SOMAXCONN)
+        rtsp_server_socket.setblocking(False)
         print(f"[RTSP Control] RTSP control server listening on TCP port {RTSP_PORT}...")
 
-        while True:
-            print("[RTSP Control] Waiting for client connection...")
-            conn, addr = rtsp_server_socket.accept()
-            client_handler = threading.Thread(target=handle_rtsp_client, args=(conn, addr))
-            client_handler.daemon = True
-            client_handler.start()
+        rtsp_selector = selectors.DefaultSelector()
+        rtsp_selector.register(rtsp_server_socket, selectors.EVENT_READ, accept_rtsp_client)
+        print("[RTSP Control] Waiting for client connections...")
+
+        # Closing the listening socket does not wake the selector, so poll with a
+        # timeout and stop once stop_server_cleanup() has cleared the socket.
+        while rtsp_server_socket is not None:
+            for key, _ in rtsp_selector.select(timeout=RTSP_SELECT_TIMEOUT):
+                callback = key.data
+                callback(key.fileobj)
 
     except OSError as e:
         if e.errno == 98:
@@ -276,6 +1263,9 @@ def start_rtsp_server_thread():
     except Exception as e:
         print(f"[RTSP Control] An unexpected error occurred in RTSP server: {e}")
     finally:
+        if rtsp_selector:
+            rtsp_selector.close()
+            rtsp_selector = None
         if rtsp_server_socket:
             print("[RTSP Control] RTSP server socket closing.")
             rtsp_server_socket.close()
@@ -285,12 +1275,14 @@ def stop_server_cleanup():
     """
     Performs graceful shutdown of all server components.
     """
-    global streaming_active, rtp_thread, rtsp_server_socket, rtsp_client_socket, rtsp_server_thread
+    global rtp_thread, rtsp_server_socket, rtsp_server_thread
 
     print("\n--- Server shutdown initiated ---")
-    streaming_active = False # Signal RTP thread to stop
+    with streaming_lock:
+        streaming_active.clear() # Signal RTP thread to stop
+        streaming_stopped.set()
 
-    # Close RTSP server socket to break accept() loop
+    # Shut down the RTSP server socket to break the selector loop
     if rtsp_server_socket:
         try:
             print("[Main] Shutting down RTSP server listening socket...")
@@ -314,15 +1306,15 @@ def stop_server_cleanup():
         if rtp_thread.is_alive():
             print("[Main] Warning: RTP streaming thread did not terminate gracefully.")
 
-    # Close any active RTSP client socket
-    if rtsp_client_socket:
+    # Close any active RTSP client sockets
+    for client_socket, client_address, _ in list(rtsp_clients.values()):
         try:
-            print("[Main] Shutting down RTSP client socket...")
-            rtsp_client_socket.shutdown(socket.SHUT_RDWR)
-            rtsp_client_socket.close()
+            print(f"[Main] Shutting down RTSP client socket for {client_address}...")
+            client_socket.shutdown(socket.SHUT_RDWR)
+            client_socket.close()
         except OSError as e:
             print(f"[Main] Error closing RTSP client socket: {e}")
-        rtsp_client_socket = None
+    rtsp_clients.clear()
 
     print("--- Server stopped successfully ---")
 
@@ -341,7 +1333,7 @@ if __name__ == "__main__":
     print(f"RTP Streaming Port (UDP): {RTP_PORT}")
     print("\nServer is ready. You can now connect with an RTSP client.")
     print(f"Example client command (using ffplay): ffplay rtsp://127.0.0.1:{RTSP_PORT}/stream")
-    print("Or use a custom client that sends 'PLAY' and 'TEARDOWN' commands to TCP port 554.")
+    print(f"Or use a custom client that sends 'PLAY' and 'TEARDOWN' commands, one per line, to TCP port {RTSP_PORT}.")
     print("\nPress Ctrl+C to stop the server.")
 
     try: